@@ -15,3 +15,30 @@ class Config:
 
     DATABASE_URL = os.getenv("DATABASE_URL")
 
+    # One of "postgres", "sqlite" or "memory"
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+    # Seconds between checks for rates updates made by other processes sharing the SQLite file
+    SQLITE_POLL_INTERVAL = float(os.getenv("SQLITE_POLL_INTERVAL", "1"))
+    # Seconds between liveness checks of the Postgres LISTEN connection and the timeout of each check
+    LISTEN_CHECK_INTERVAL = float(os.getenv("LISTEN_CHECK_INTERVAL", "5"))
+    LISTEN_CHECK_TIMEOUT = float(os.getenv("LISTEN_CHECK_TIMEOUT", "2"))
+
+    # Database circuit breaker
+    DB_FAILURE_THRESHOLD = int(os.getenv("DB_FAILURE_THRESHOLD", "5"))
+    DB_RESET_TIMEOUT = float(os.getenv("DB_RESET_TIMEOUT", "30"))
+    DB_READ_TIMEOUT = float(os.getenv("DB_READ_TIMEOUT", "2"))
+    DB_UPDATE_TIMEOUT = float(os.getenv("DB_UPDATE_TIMEOUT", "30"))
+    # Rate history reads of bulk conversions have their own breaker, so slow batches do not affect other reads
+    DB_BULK_TIMEOUT = float(os.getenv("DB_BULK_TIMEOUT", "30"))
+
+    # Maximum number of conversions in one bulk request
+    BULK_CONVERT_MAX_ROWS = int(os.getenv("BULK_CONVERT_MAX_ROWS", "10000"))
+
+    # Maximum age in seconds of the last-known-good rates served while the database is unavailable
+    STALE_RATES_MAX_AGE = float(os.getenv("STALE_RATES_MAX_AGE", "3600"))
+
+    # Logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Share of requests written to the access log, from 0 to 1
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1"))
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.utils.logger import logger
+
+
+class DatabaseUnavailable(Exception):
+    """
+    Raised when the database cannot be used and there is nothing to serve instead.
+    """
+
+
+class CircuitBreakerOpen(DatabaseUnavailable):
+    """
+    Raised instead of calling the database while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the database calls.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls fail immediately with
+    CircuitBreakerOpen. After `reset_timeout` seconds a single trial call is let through: if it succeeds
+    the breaker closes, otherwise it opens again. Every call is limited by a timeout, so a hanging database
+    counts as a failure instead of blocking requests until the connection timeout.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, call_timeout: float = 2.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def _before_call(self) -> None:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitBreakerOpen("Database circuit breaker is open.")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # Only one trial call at a time, the rest fail fast until it is finished
+            if self.trial_in_progress:
+                raise CircuitBreakerOpen("Database circuit breaker is open.")
+            self.trial_in_progress = True
+
+    def _on_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Database circuit breaker is closed.")
+        self.reset()
+
+    def _on_failure(self, error: BaseException) -> None:
+        self.trial_in_progress = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Database circuit breaker is open after error: %r", error)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, func: Callable[..., Awaitable], *args, timeout: Optional[float] = None):
+        """
+        Calls the coroutine function through the breaker.
+
+        :param func: Coroutine function accessing the database.
+        :param args: Arguments of the function.
+        :param timeout: Timeout of this call in seconds, `call_timeout` is used if it is not given.
+        :return: The result of the function.
+        :raises CircuitBreakerOpen: If the breaker is open.
+        """
+        self._before_call()
+        try:
+            result = await asyncio.wait_for(func(*args), timeout if timeout is not None else self.call_timeout)
+        except asyncio.CancelledError:
+            self.trial_in_progress = False
+            raise
+        except Exception as e:
+            self._on_failure(e)
+            raise
+        self._on_success()
+        return result
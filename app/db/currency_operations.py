@@ -1,95 +1,135 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Optional
 
-from sqlalchemy import update
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from app.db.models.currency import CurrencyUpdate, Currency
+from app.config import Config
+from app.db.circuit_breaker import CircuitBreaker, CircuitBreakerOpen, DatabaseUnavailable
+from app.db.rates_cache import rates_cache, RatesCache
+from app.db.repository import CurrencyRepository
+from app.utils.logger import logger
 
+database_breaker = CircuitBreaker(failure_threshold=Config.DB_FAILURE_THRESHOLD,
+                                  reset_timeout=Config.DB_RESET_TIMEOUT,
+                                  call_timeout=Config.DB_READ_TIMEOUT)
+bulk_history_breaker = CircuitBreaker(failure_threshold=Config.DB_FAILURE_THRESHOLD,
+                                      reset_timeout=Config.DB_RESET_TIMEOUT,
+                                      call_timeout=Config.DB_BULK_TIMEOUT)
 
-async def get_last_update_time(session: AsyncSession) -> datetime:
+# Staleness of the rates served in the current request, see `track_staleness`
+_served_staleness: ContextVar[Optional[dict]] = ContextVar("served_staleness", default=None)
+
+
+@contextmanager
+def track_staleness():
+    """
+    Collects the staleness of the rates served inside the block.
+
+    Yields a dictionary which gets the 'staleness' key (seconds) if last-known-good rates were served
+    because the database was unavailable.
     """
-    Asynchronously retrieves the last update time of the exchange rates in the database.
+    staleness = {}
+    token = _served_staleness.set(staleness)
+    try:
+        yield staleness
+    finally:
+        _served_staleness.reset(token)
+
 
-    :param session: The SQLAlchemy async session to execute database operations.
-    :type session: AsyncSession
+async def _get_rates(repository: CurrencyRepository) -> RatesCache:
+    """
+    Returns the rates cache, reloading it from the repository through the database circuit breaker if needed.
+
+    If the database fails or the breaker is open, last-known-good rates are served while they are not older
+    than `Config.STALE_RATES_MAX_AGE` seconds. Otherwise DatabaseUnavailable is raised.
+    """
+    if rates_cache.is_fresh:
+        return rates_cache
+    try:
+        # The breaker limits the load only, waiting for the loads of other requests is not a database failure
+        return await rates_cache.refresh(repository, database_breaker.call)
+    except Exception as e:
+        staleness = rates_cache.staleness
+        if staleness is None or staleness > Config.STALE_RATES_MAX_AGE:
+            if isinstance(e, DatabaseUnavailable):
+                raise
+            raise DatabaseUnavailable("Database is temporarily unavailable.") from e
+        if not isinstance(e, CircuitBreakerOpen):
+            logger.warning("Serving stale rates (%.0fs old) after database error: %r", staleness, e)
+        served = _served_staleness.get()
+        if served is not None:
+            served['staleness'] = max(served.get('staleness', 0.0), staleness)
+        return rates_cache
+
+
+async def get_last_update_time(repository: CurrencyRepository) -> datetime:
+    """
+    Asynchronously retrieves the last update time of the exchange rates in the storage.
+
+    :param repository: The repository of the configured storage backend.
+    :type repository: CurrencyRepository
     :return: The timestamp of the last update or None if no updates are found.
     :rtype: datetime or None
 
-    This function executes a query to find the most recent update record in the CurrencyUpdate table,
-    ordering by the `last_updated` field in descending order and returning the latest update time.
-    If no records are found, it returns None.
+    The time is served from the per-process rates cache, which is reloaded from the repository
+    after every rates update. If no records are found, it returns None.
     """
-    async with session.begin():
-        query = select(CurrencyUpdate).order_by(CurrencyUpdate.last_updated.desc()).limit(1)
-        result = await session.execute(query)
-        last_update = result.scalars().first()
-        return last_update.last_updated if last_update else None
+    cache = await _get_rates(repository)
+    return cache.last_updated
 
 
-async def update_exchange_rates(session: AsyncSession, rates: dict) -> None:
+async def update_exchange_rates(repository: CurrencyRepository, rates: dict) -> None:
     """
-    Asynchronously updates exchange rates in the database with the provided rates,
+    Asynchronously updates exchange rates in the storage with the provided rates,
     and records the time of the update.
 
-    :param session: The SQLAlchemy async session to execute database operations.
-    :type session: AsyncSession
+    :param repository: The repository of the configured storage backend.
+    :type repository: CurrencyRepository
     :param rates: A dictionary of currency codes to their respective new exchange rates.
     :type rates: dict
     :return: None
 
-    For each currency code in the `rates` dictionary, this function updates the corresponding record
-    in the Currency table with the new rate. It then adds a new record to the CurrencyUpdate table
-    to log the time of the update. This operation is performed within a transaction.
+    For each currency code in the `rates` dictionary, this function updates the corresponding currency
+    with the new rate. It then records the time of the update. SQL backends perform this within a transaction.
+    Other workers learn about the update from the repository notifier, the local rates cache is invalidated here.
     """
-    async with session.begin():
-        # Update currencies rates
-        for code, rate in rates.items():
-            await session.execute(
-                update(Currency).
-                where(Currency.code == code).
-                values(rate=rate)
-            )
-
-        # Add last update record
-        last_update_record = CurrencyUpdate(last_updated=datetime.now(timezone.utc))
-        session.add(last_update_record)
-        await session.commit()
+    await database_breaker.call(repository.update_rates, rates, datetime.now(timezone.utc),
+                                timeout=Config.DB_UPDATE_TIMEOUT)
+    rates_cache.invalidate()
 
 
-async def get_currency_rate(session: AsyncSession, currency_code: str) -> Decimal:
+async def get_currency_rate(repository: CurrencyRepository, currency_code: str) -> Decimal:
     """
-    Asynchronously retrieves the exchange rate for a given currency code from the database.
+    Asynchronously retrieves the exchange rate for a given currency code from the storage.
 
-    :param session: The SQLAlchemy asynchronous session to use for database queries.
-    :type session: AsyncSession
+    :param repository: The repository of the configured storage backend.
+    :type repository: CurrencyRepository
     :param currency_code: The ISO currency code to retrieve the exchange rate for.
     :type currency_code: str
     :return: The exchange rate of the currency.
     :rtype: float
-    :raises ValueError: If the currency code is not found in the database.
+    :raises ValueError: If the currency code is not found in the storage.
+    :raises DatabaseUnavailable: If the database is unavailable and there are no last-known-good rates.
 
     Example:
-        async with AsyncSession() as session:
-            rate = await get_currency_rate(session, 'USD')
-            print(f"The exchange rate for USD is {rate}.")
+        repository = InMemoryCurrencyRepository.from_initial_data()
+        rate = await get_currency_rate(repository, 'USD')
+        print(f"The exchange rate for USD is {rate}.")
     """
-    async with session.begin():
-        currency_query = await session.execute(
-            select(Currency.rate).where(Currency.code == currency_code)
-        )
-        currency_rate = currency_query.scalars().first()
-        if currency_rate is None:
-            raise ValueError(f"Currency {currency_code} is not available.")
-        return currency_rate
+    cache = await _get_rates(repository)
+    currency = cache.currencies.get(currency_code)
+    if currency is None:
+        raise ValueError(f"Currency {currency_code} is not available.")
+    return currency['rate']
 
 
-async def convert_currency(session: AsyncSession, source: str, target: str, amount: float) -> Decimal:
+async def convert_currency(repository: CurrencyRepository, source: str, target: str, amount: float) -> Decimal:
     """
     Converts an amount from one currency to another using their exchange rates.
 
-    :param session: The SQLAlchemy asynchronous session to use for database queries.
-    :type session: AsyncSession
+    :param repository: The repository of the configured storage backend.
+    :type repository: CurrencyRepository
     :param source: The ISO code of the source currency.
     :type source: str
     :param target: The ISO code of the target currency.
@@ -98,35 +138,94 @@ async def convert_currency(session: AsyncSession, source: str, target: str, amou
     :type amount: float
     :return: The amount converted into the target currency.
     :rtype: float
-    :raises ValueError: If either the source or target currency code is not found in the database.
+    :raises ValueError: If either the source or target currency code is not found in the storage.
 
     Example:
-        async with AsyncSession() as session:
-            converted_amount = await convert_currency(session, 'EUR', 'USD', 100)
-            print(f"100 EUR is equivalent to {converted_amount} USD.")
+        repository = InMemoryCurrencyRepository.from_initial_data()
+        converted_amount = await convert_currency(repository, 'EUR', 'USD', 100)
+        print(f"100 EUR is equivalent to {converted_amount} USD.")
     """
     # Get source currency rate
-    source_rate = await get_currency_rate(session, source)
+    source_rate = await get_currency_rate(repository, source)
 
     # Get target currency rate
-    target_rate = await get_currency_rate(session, target)
+    target_rate = await get_currency_rate(repository, target)
 
+    return _convert_amount(amount, source_rate, target_rate)
+
+
+def _convert_amount(amount: float, source_rate: Decimal, target_rate: Decimal) -> Decimal:
     amount_decimal = Decimal(str(amount))
 
     # Make conversion
-    converted_amount = amount_decimal * (target_rate / source_rate)
-    return converted_amount
+    return amount_decimal * (target_rate / source_rate)
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # Naive timestamps are treated as UTC, like the update times
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
 
+async def convert_currencies_as_of(repository: CurrencyRepository, conversions: list) -> list:
+    """
+    Converts many amounts, each one with the rates that were valid at its own timestamp.
+
+    :param repository: The repository of the configured storage backend.
+    :type repository: CurrencyRepository
+    :param conversions: A list of (amount, source, target, timestamp) tuples.
+    :type conversions: list
+    :return: The converted amounts in the order of the conversions.
+    :rtype: list
+    :raises ValueError: If a currency has no rate at the timestamp of a conversion.
+    :raises DatabaseUnavailable: If the rate history cannot be read.
+
+    Conversions are sorted by timestamp and resolved in a single merge pass over the rate history
+    of the involved currencies, so the work is linear in the number of conversions and history records
+    after sorting. The rate of a currency at a moment is the last rate recorded not later than that moment.
 
-async def get_currencies(session: AsyncSession) -> list:
+    Example:
+        repository = InMemoryCurrencyRepository.from_initial_data()
+        converted_amounts = await convert_currencies_as_of(repository, [(100, 'EUR', 'USD', datetime.now())])
+    """
+    if not conversions:
+        return []
+
+    timestamps = [_as_utc(conversion[3]) for conversion in conversions]
+    order = sorted(range(len(conversions)), key=timestamps.__getitem__)
+    codes = {code for conversion in conversions for code in conversion[1:3]}
+
+    try:
+        history = await bulk_history_breaker.call(repository.get_rate_history, codes, timestamps[order[-1]])
+    except DatabaseUnavailable:
+        raise
+    except Exception as e:
+        raise DatabaseUnavailable("Database is temporarily unavailable.") from e
+
+    rates = {}
+    converted_amounts = [None] * len(conversions)
+    position = 0
+    for index in order:
+        # Apply every rate recorded up to the timestamp of this conversion
+        while position < len(history) and _as_utc(history[position][0]) <= timestamps[index]:
+            _, code, rate = history[position]
+            rates[code] = rate
+            position += 1
+
+        amount, source, target, _ = conversions[index]
+        for code in (source, target):
+            if code not in rates:
+                raise ValueError(f"Currency {code} is not available at {timestamps[index].isoformat()}.")
+        converted_amounts[index] = _convert_amount(amount, rates[source], rates[target])
+
+    return converted_amounts
+
+
+async def get_currencies(repository: CurrencyRepository) -> list:
     """
-    Fetches all currencies from the database.
+    Fetches all currencies from the storage.
 
-    :param AsyncSession session: The session for database operations.
-    :return: A list of Currency objects.
+    :param CurrencyRepository repository: The repository of the configured storage backend.
+    :return: A list of dictionaries with 'rate', 'code' and 'name' of every currency.
     """
-    result = await session.execute(
-        select(Currency.rate, Currency.code, Currency.name)
-    )
-    currencies = result.all()
-    return currencies
+    cache = await _get_rates(repository)
+    return [dict(currency) for currency in cache.currencies.values()]
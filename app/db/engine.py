@@ -1,12 +1,84 @@
+from decimal import Decimal
+from typing import Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, AsyncEngine
+from sqlalchemy.future import select
 from sqlalchemy.orm import sessionmaker
 
 from app.config import Config
+from app.db.migrations.initial_currencies import initial_currencies, last_update_time
+from app.db.models import BaseModel
+from app.db.models.currency import Currency, CurrencyUpdate, CurrencyRateHistory
+from app.db.notifier import RatesNotifier, LocalRatesNotifier, PostgresRatesNotifier, PollingRatesNotifier
+from app.db.repository import CurrencyRepository, SQLAlchemyCurrencyRepository, InMemoryCurrencyRepository
+
+STORAGE_BACKENDS = ("postgres", "sqlite", "memory")
+
+if Config.STORAGE_BACKEND not in STORAGE_BACKENDS:
+    raise ValueError(f"Unknown storage backend {Config.STORAGE_BACKEND}. Expected one of {STORAGE_BACKENDS}.")
+
+# Memory backend works without any database, so the engine is created only for SQL backends
+engine: Optional[AsyncEngine] = None
+if Config.STORAGE_BACKEND != "memory":
+    engine = create_async_engine(Config.DATABASE_URL, future=True)
 
-engine: AsyncEngine = create_async_engine(Config.DATABASE_URL, future=True)
+# Postgres delivers rates updates to every node, SQLite file can be shared by worker processes of one node
+# and is polled, memory storage belongs to a single process
+rates_notifier: RatesNotifier
+if Config.STORAGE_BACKEND == "postgres":
+    rates_notifier = PostgresRatesNotifier(Config.DATABASE_URL, check_interval=Config.LISTEN_CHECK_INTERVAL,
+                                           check_timeout=Config.LISTEN_CHECK_TIMEOUT)
+elif Config.STORAGE_BACKEND == "sqlite":
+    rates_notifier = PollingRatesNotifier(engine, Config.SQLITE_POLL_INTERVAL)
+else:
+    rates_notifier = LocalRatesNotifier()
+
+memory_repository: Optional[InMemoryCurrencyRepository] = None
+if Config.STORAGE_BACKEND == "memory":
+    memory_repository = InMemoryCurrencyRepository.from_initial_data(rates_notifier)
 
 
 async def get_session() -> AsyncSession:
     async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     async with async_session() as session:
         yield session
+
+
+async def get_repository() -> CurrencyRepository:
+    """
+    Dependency that provides the repository of the configured storage backend.
+    """
+    if memory_repository is not None:
+        yield memory_repository
+        return
+
+    async for session in get_session():
+        yield SQLAlchemyCurrencyRepository(session, rates_notifier)
+
+
+async def init_storage() -> None:
+    """
+    Prepares the configured storage backend on startup.
+
+    PostgreSQL schema is managed by Alembic migrations. SQLite is meant for local and single node usage,
+    so its schema is created from the models and seeded with the initial currencies if it is empty.
+    """
+    if Config.STORAGE_BACKEND != "sqlite":
+        return
+
+    async with engine.begin() as connection:
+        await connection.run_sync(BaseModel.metadata.create_all)
+
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(select(Currency.id).limit(1))
+            if result.scalars().first() is not None:
+                return
+            session.add_all([Currency(name=currency['name'], code=currency['code'],
+                                      rate=Decimal(str(currency['rate'])))
+                             for currency in initial_currencies])
+            session.add_all([CurrencyRateHistory(code=currency['code'], rate=Decimal(str(currency['rate'])),
+                                                 valid_from=last_update_time)
+                             for currency in initial_currencies])
+            session.add(CurrencyUpdate(last_updated=last_update_time))
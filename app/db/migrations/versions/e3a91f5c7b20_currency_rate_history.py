@@ -0,0 +1,37 @@
+"""currency rate history
+
+Revision ID: e3a91f5c7b20
+Revises: c4bfb3d9c23d
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e3a91f5c7b20'
+down_revision = 'c4bfb3d9c23d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('currency_rate_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(), nullable=False),
+    sa.Column('rate', sa.DECIMAL(), nullable=False),
+    sa.Column('valid_from', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_currency_rate_history_code_valid_from', 'currency_rate_history', ['code', 'valid_from'],
+                    unique=False)
+
+    # Current rates are the first history records, valid since the last update
+    op.execute("INSERT INTO currency_rate_history (code, rate, valid_from) "
+               "SELECT currencies.code, currencies.rate, "
+               "(SELECT coalesce(max(last_updated), now()) FROM currency_updates) FROM currencies")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_currency_rate_history_code_valid_from', table_name='currency_rate_history')
+    op.drop_table('currency_rate_history')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, func, DateTime, DECIMAL
+from sqlalchemy import Column, Integer, String, func, DateTime, DECIMAL, Index
 from app.db.models import BaseModel
 
 
@@ -16,3 +16,13 @@ class CurrencyUpdate(BaseModel):
 
     id = Column(Integer, primary_key=True)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class CurrencyRateHistory(BaseModel):
+    __tablename__ = 'currency_rate_history'
+    __table_args__ = (Index('ix_currency_rate_history_code_valid_from', 'code', 'valid_from'),)
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String, nullable=False)
+    rate = Column(DECIMAL(), nullable=False)
+    valid_from = Column(DateTime(timezone=True), nullable=False)
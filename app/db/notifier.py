@@ -0,0 +1,246 @@
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import asyncpg
+from sqlalchemy import text, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from sqlalchemy.future import select
+
+from app.db.models.currency import CurrencyUpdate
+
+from app.utils.logger import logger
+
+RATES_CHANNEL = "currency_rates"
+
+
+@dataclass
+class RatesUpdateEvent:
+    """
+    Notification about committed rates update.
+
+    :param str version: ISO formatted time of the update, the same value as stored in the currency updates.
+    :param list codes: Codes of the updated currencies.
+    """
+    version: str
+    codes: list = field(default_factory=list)
+
+    def to_payload(self) -> str:
+        return json.dumps({"version": self.version, "codes": self.codes})
+
+    @classmethod
+    def from_payload(cls, payload: str) -> "RatesUpdateEvent":
+        data = json.loads(payload)
+        return cls(version=data["version"], codes=data.get("codes", []))
+
+
+# Listener receives the event or None when notifications could have been missed
+RatesListener = Callable[[Optional[RatesUpdateEvent]], None]
+
+
+class RatesNotifier:
+    """
+    Delivers rates update events to every worker.
+
+    Repositories call `publish_in_transaction` inside the update transaction and `publish_committed`
+    after it is committed, so each notifier can choose the right moment to deliver the event.
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    @property
+    def is_listening(self) -> bool:
+        """
+        Whether events are delivered right now. Local data must not be trusted while it is False.
+        """
+        return True
+
+    async def publish_in_transaction(self, session: AsyncSession, event: RatesUpdateEvent) -> None:
+        pass
+
+    async def publish_committed(self, event: RatesUpdateEvent) -> None:
+        pass
+
+    async def listen(self, listener: RatesListener) -> None:
+        self.listeners.append(listener)
+
+    async def close(self) -> None:
+        self.listeners = []
+
+    def dispatch(self, event: Optional[RatesUpdateEvent]) -> None:
+        for listener in self.listeners:
+            listener(event)
+
+
+class LocalRatesNotifier(RatesNotifier):
+    """
+    In-process stand-in for the Postgres notifier. Used with memory storage and in tests.
+    """
+
+    async def publish_committed(self, event: RatesUpdateEvent) -> None:
+        self.dispatch(event)
+
+
+class PollingRatesNotifier(LocalRatesNotifier):
+    """
+    Notifier for SQLite, which has no LISTEN/NOTIFY.
+
+    Several worker processes can share one SQLite file, so besides notifying its own process the notifier
+    polls the last update time and dispatches an event when another process has changed it.
+    Local data is not trusted while polling fails.
+    """
+
+    def __init__(self, engine: AsyncEngine, interval: float = 1.0):
+        super().__init__()
+        self.engine = engine
+        self.interval = interval
+        self.last_updated = None
+        self.polling = False
+        self.poll_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_listening(self) -> bool:
+        return self.polling
+
+    async def listen(self, listener: RatesListener) -> None:
+        await super().listen(listener)
+        if self.poll_task is None:
+            self.poll_task = asyncio.get_running_loop().create_task(self._poll())
+
+    async def close(self) -> None:
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            self.poll_task = None
+        self.polling = False
+        await super().close()
+
+    async def poll_once(self) -> None:
+        async with self.engine.connect() as connection:
+            result = await connection.execute(select(func.max(CurrencyUpdate.last_updated)))
+            last_updated = result.scalar()
+        if not self.polling:
+            # The first successful poll after start or failures can follow missed updates
+            self.dispatch(None)
+        elif last_updated != self.last_updated and last_updated is not None:
+            self.dispatch(RatesUpdateEvent(version=last_updated.isoformat()))
+        self.last_updated = last_updated
+        self.polling = True
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                if self.polling:
+                    logger.warning("Rates update polling failed: %r", e)
+                self.polling = False
+                self.dispatch(None)
+            await asyncio.sleep(self.interval)
+
+
+class PostgresRatesNotifier(RatesNotifier):
+    """
+    Notifier based on Postgres LISTEN/NOTIFY.
+
+    NOTIFY is sent in the update transaction, so Postgres delivers it to every listening worker
+    only if the transaction is committed. Each worker holds a dedicated LISTEN connection
+    and reconnects if it is lost. The connection is checked with `SELECT 1` every `check_interval` seconds:
+    a half-open connection (e.g. after a network partition) is never reported as closed and would miss
+    notifications silently.
+    """
+
+    def __init__(self, database_url: str, reconnect_delay: float = 1.0, check_interval: float = 5.0,
+                 check_timeout: float = 2.0):
+        super().__init__()
+        # asyncpg does not understand SQLAlchemy driver names like "postgresql+asyncpg"
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.reconnect_delay = reconnect_delay
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.connection: Optional[asyncpg.Connection] = None
+        self.reconnect_task: Optional[asyncio.Task] = None
+        self.check_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    @property
+    def is_listening(self) -> bool:
+        return self.connection is not None and not self.connection.is_closed()
+
+    async def publish_in_transaction(self, session: AsyncSession, event: RatesUpdateEvent) -> None:
+        await session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                              {"channel": RATES_CHANNEL, "payload": event.to_payload()})
+
+    async def listen(self, listener: RatesListener) -> None:
+        await super().listen(listener)
+        if self.connection is None and self.reconnect_task is None:
+            # Connection is made in background, so the app starts even if Postgres is not available yet
+            self.reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def close(self) -> None:
+        self.closed = True
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+        if self.check_task is not None:
+            self.check_task.cancel()
+        if self.connection is not None and not self.connection.is_closed():
+            await self.connection.close()
+        self.connection = None
+        await super().close()
+
+    async def _connect(self) -> None:
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(RATES_CHANNEL, self._on_notification)
+        except BaseException:
+            await connection.close()
+            raise
+        connection.add_termination_listener(self._on_termination)
+        self.connection = connection
+        self.check_task = asyncio.get_running_loop().create_task(self._check_connection(connection))
+        # Updates committed while there was no LISTEN connection are unknown
+        self.dispatch(None)
+        logger.info("Listening for rates updates on channel %s", RATES_CHANNEL)
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        try:
+            event = RatesUpdateEvent.from_payload(payload)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Invalid rates update payload: %s", payload)
+            event = None
+        self.dispatch(event)
+
+    def _on_termination(self, connection) -> None:
+        # Connection dropped by a failed check is terminated after the reconnect is started
+        if connection is not self.connection:
+            return
+        self.connection = None
+        self.dispatch(None)
+        if not self.closed:
+            logger.warning("Rates LISTEN connection is lost, reconnecting...")
+            self.reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _check_connection(self, connection: asyncpg.Connection) -> None:
+        while not self.closed and connection is self.connection:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.wait_for(connection.fetchval("SELECT 1"), self.check_timeout)
+            except Exception as e:
+                if connection is not self.connection:
+                    return
+                logger.warning("Rates LISTEN connection check failed: %r", e)
+                # Handled the same as a lost connection: local data is invalidated and a new connection is made
+                self._on_termination(connection)
+                connection.terminate()
+                return
+
+    async def _reconnect(self) -> None:
+        while not self.closed and self.connection is None:
+            try:
+                await self._connect()
+            except Exception as e:
+                # Any error must be retried, otherwise the worker never trusts its rates cache again
+                logger.warning("Rates LISTEN reconnect failed: %r", e)
+                await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from app.db.notifier import RatesNotifier, RatesUpdateEvent
+from app.db.repository import CurrencyRepository
+
+
+class RatesCache:
+    """
+    Per-process copy of the currencies and the time of their last update.
+
+    The copy is used only while it is fresh: it was loaded after the last known rates update and the notifier
+    is delivering update events. Invalidated data is kept, it is reloaded on the next read.
+    """
+
+    def __init__(self):
+        self.currencies: Optional[dict] = None
+        self.last_updated: Optional[datetime] = None
+        # Monotonic times of the last successful load and of the first invalidation after it
+        self.loaded_at: Optional[float] = None
+        self.stale_since: Optional[float] = None
+        self.stale = True
+        # Incremented on every invalidation, so a load racing with an update is not marked as fresh
+        self.generation = 0
+        # Incremented on every completed load, so callers which waited for a load do not repeat it
+        self.loads = 0
+        self.notifier: Optional[RatesNotifier] = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def is_fresh(self) -> bool:
+        if self.stale or self.currencies is None:
+            return False
+        return self.notifier is None or self.notifier.is_listening
+
+    async def track(self, notifier: RatesNotifier) -> None:
+        """
+        Subscribes the cache to the rates update events of the notifier.
+        """
+        self.notifier = notifier
+        await notifier.listen(self.on_rates_updated)
+
+    def on_rates_updated(self, event: Optional[RatesUpdateEvent]) -> None:
+        # Skip the event if the update is already loaded, e.g. by the worker which made it
+        if (event is not None and not self.stale and self.last_updated is not None
+                and event.version == self.last_updated.isoformat()):
+            return
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        if self.stale_since is None:
+            self.stale_since = time.monotonic()
+        self.stale = True
+        self.generation += 1
+
+    @property
+    def staleness(self) -> Optional[float]:
+        """
+        Seconds since the data was last known to be up to date or None if nothing is loaded.
+        """
+        if self.loaded_at is None:
+            return None
+        if self.is_fresh:
+            return 0.0
+        known_good_at = self.stale_since if self.stale_since is not None else self.loaded_at
+        return time.monotonic() - known_good_at
+
+    def clear(self) -> None:
+        self.currencies = None
+        self.last_updated = None
+        self.loaded_at = None
+        self.invalidate()
+        self.stale_since = None
+
+    async def load(self, repository: CurrencyRepository) -> None:
+        """
+        Loads currencies and the last update time from the repository.
+        """
+        generation = self.generation
+        last_updated = await repository.get_last_update_time()
+        currencies = await repository.get_currencies()
+        self.currencies = {currency['code']: currency for currency in currencies}
+        self.last_updated = last_updated
+        self.loaded_at = time.monotonic()
+        self.loads += 1
+        self.stale = generation != self.generation
+        if not self.stale:
+            self.stale_since = None
+
+    async def refresh(self, repository: CurrencyRepository,
+                      call: Optional[Callable[..., Awaitable]] = None) -> "RatesCache":
+        """
+        Reloads the data if it is not fresh. Concurrent callers share a single load.
+
+        A caller which waited for the lock while another caller loaded the data uses that data
+        unless it was invalidated since, even if the notifier is not listening and the data is never fresh.
+
+        :param repository: The repository to load the data from.
+        :param call: Wrapper called with the load and the repository, e.g. a circuit breaker call.
+            It wraps only the load, not the wait for other callers.
+        """
+        if not self.is_fresh:
+            loads = self.loads
+            async with self.lock:
+                if not self.is_fresh and (self.loads == loads or self.stale):
+                    if call is None:
+                        await self.load(repository)
+                    else:
+                        await call(self.load, repository)
+        return self
+
+
+rates_cache = RatesCache()
@@ -0,0 +1,166 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import update, insert, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.db.migrations.initial_currencies import initial_currencies, last_update_time
+from app.db.models.currency import CurrencyUpdate, Currency, CurrencyRateHistory
+from app.db.notifier import RatesNotifier, RatesUpdateEvent
+
+
+class CurrencyRepository(ABC):
+    """
+    Storage interface used by the currency operations.
+
+    Every backend stores the same data: a list of currencies (name, code and EUR based rate),
+    the history of their rates and the history of rate update times.
+    Rates updates are announced with the notifier if it is given.
+    """
+
+    notifier: Optional[RatesNotifier] = None
+
+    @abstractmethod
+    async def get_last_update_time(self) -> Optional[datetime]:
+        """
+        Returns the time of the most recent rates update or None if no updates are found.
+        """
+
+    @abstractmethod
+    async def update_rates(self, rates: dict, updated_at: datetime) -> None:
+        """
+        Updates rates of the known currencies and records the time of the update.
+
+        :param dict rates: A dictionary of currency codes to their respective new exchange rates.
+        :param datetime updated_at: The time of the update.
+        """
+
+    @abstractmethod
+    async def get_currencies(self) -> list:
+        """
+        Returns a list of dictionaries with 'rate', 'code' and 'name' of every currency.
+        """
+
+    @abstractmethod
+    async def get_rate_history(self, codes: set, until: datetime) -> list:
+        """
+        Returns rates of the given currencies that became valid not later than `until`.
+
+        :param set codes: Currency codes to return the history for.
+        :param datetime until: The latest time of interest.
+        :return: A list of (valid_from, code, rate) tuples ordered by valid_from.
+        """
+
+
+class SQLAlchemyCurrencyRepository(CurrencyRepository):
+    """
+    Repository backed by a SQLAlchemy async session. Used for both PostgreSQL and SQLite storage.
+    """
+
+    def __init__(self, session: AsyncSession, notifier: Optional[RatesNotifier] = None):
+        self.session = session
+        self.notifier = notifier
+
+    async def get_last_update_time(self) -> Optional[datetime]:
+        async with self.session.begin():
+            query = select(CurrencyUpdate).order_by(CurrencyUpdate.last_updated.desc()).limit(1)
+            result = await self.session.execute(query)
+            last_update = result.scalars().first()
+            return last_update.last_updated if last_update else None
+
+    async def update_rates(self, rates: dict, updated_at: datetime) -> None:
+        event = RatesUpdateEvent(version=updated_at.isoformat(), codes=sorted(rates))
+        async with self.session.begin():
+            # Update currencies rates
+            for code, rate in rates.items():
+                await self.session.execute(
+                    update(Currency).
+                    where(Currency.code == code).
+                    values(rate=rate)
+                )
+
+            # Record new rates of the known currencies in the history
+            valid_from = literal(updated_at, CurrencyRateHistory.valid_from.type)
+            await self.session.execute(
+                insert(CurrencyRateHistory).
+                from_select(['code', 'rate', 'valid_from'],
+                            select(Currency.code, Currency.rate, valid_from).where(Currency.code.in_(list(rates))))
+            )
+
+            # Add last update record
+            self.session.add(CurrencyUpdate(last_updated=updated_at))
+
+            if self.notifier is not None:
+                await self.notifier.publish_in_transaction(self.session, event)
+
+        if self.notifier is not None:
+            await self.notifier.publish_committed(event)
+
+    async def get_currencies(self) -> list:
+        async with self.session.begin():
+            result = await self.session.execute(
+                select(Currency.rate, Currency.code, Currency.name)
+            )
+            return [dict(row._mapping) for row in result.all()]
+
+    async def get_rate_history(self, codes: set, until: datetime) -> list:
+        async with self.session.begin():
+            result = await self.session.execute(
+                select(CurrencyRateHistory.valid_from, CurrencyRateHistory.code, CurrencyRateHistory.rate).
+                where(CurrencyRateHistory.code.in_(list(codes)), CurrencyRateHistory.valid_from <= until).
+                order_by(CurrencyRateHistory.valid_from)
+            )
+            return [tuple(row) for row in result.all()]
+
+
+class InMemoryCurrencyRepository(CurrencyRepository):
+    """
+    Repository that keeps all data in the process memory. Nothing is persisted between restarts.
+    """
+
+    def __init__(self, currencies: list, last_updated: Optional[datetime] = None,
+                 notifier: Optional[RatesNotifier] = None):
+        self.currencies = {
+            currency['code']: {'rate': Decimal(str(currency['rate'])),
+                               'code': currency['code'],
+                               'name': currency['name']}
+            for currency in currencies
+        }
+        self.updates = [last_updated] if last_updated else []
+        # (valid_from, code, rate) tuples in the order of updates
+        self.history = []
+        if last_updated:
+            self.history = [(last_updated, code, currency['rate']) for code, currency in self.currencies.items()]
+        self.notifier = notifier
+
+    @classmethod
+    def from_initial_data(cls, notifier: Optional[RatesNotifier] = None) -> "InMemoryCurrencyRepository":
+        """
+        Creates a repository seeded with the same data as the initial migrations.
+        """
+        return cls(initial_currencies, last_update_time.replace(tzinfo=timezone.utc), notifier)
+
+    async def get_last_update_time(self) -> Optional[datetime]:
+        return max(self.updates) if self.updates else None
+
+    async def update_rates(self, rates: dict, updated_at: datetime) -> None:
+        for code, rate in rates.items():
+            # Unknown codes are skipped, the same as UPDATE ... WHERE code = ... does
+            if code in self.currencies:
+                self.currencies[code]['rate'] = Decimal(str(rate))
+                self.history.append((updated_at, code, self.currencies[code]['rate']))
+        self.updates.append(updated_at)
+
+        if self.notifier is not None:
+            event = RatesUpdateEvent(version=updated_at.isoformat(), codes=sorted(rates))
+            await self.notifier.publish_committed(event)
+
+    async def get_currencies(self) -> list:
+        return [dict(currency) for currency in self.currencies.values()]
+
+    async def get_rate_history(self, codes: set, until: datetime) -> list:
+        return sorted((record for record in self.history if record[1] in codes and record[0] <= until),
+                      key=lambda record: record[0])
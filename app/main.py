@@ -1,47 +1,118 @@
-from fastapi import FastAPI, HTTPException, Depends
+import time
+import uuid
+from datetime import datetime
+
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import Config
-from app.db.currency_operations import get_last_update_time, update_exchange_rates, convert_currency, get_currencies
-from app.db.engine import get_session
+from app.db.circuit_breaker import DatabaseUnavailable
+from app.db.currency_operations import get_last_update_time, update_exchange_rates, convert_currency, get_currencies, \
+    track_staleness, convert_currencies_as_of
+from app.db.rates_cache import rates_cache
+from app.db.repository import CurrencyRepository
+from app.db.engine import get_repository, init_storage, rates_notifier
+from app.services.content_negotiation import EncodedResponseCache, negotiated_response
 from app.services.exchange_rates import fetch_current_exchange_rates
-from app.utils.logger import logger
+from app.utils.logger import logger, access_logger, request_id_var
 
 app = FastAPI()
 
+currencies_response_cache = EncodedResponseCache()
+
 
 @app.on_event("startup")
 async def on_startup():
     logger.info("Starting up the application...")
+    await init_storage()
+    await rates_cache.track(rates_notifier)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await rates_notifier.close()
+
+
+@app.middleware("http")
+async def add_staleness_headers(request: Request, call_next):
+    """
+    Marks responses built from last-known-good rates while the database was unavailable.
+    """
+    with track_staleness() as staleness:
+        response = await call_next(request)
+    if 'staleness' in staleness:
+        response.headers["Age"] = str(int(staleness['staleness']))
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+
+@app.middleware("http")
+async def log_requests(request: Request, call_next):
+    """
+    Assigns the request ID to every record logged while handling the request and writes the access log.
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    try:
+        try:
+            response = await call_next(request)
+        except Exception:
+            # Unhandled errors become 500 responses outside of this middleware, log them with the request ID here
+            _log_access(request, 500, started)
+            raise
+        _log_access(request, response.status_code, started)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
+
+def _log_access(request: Request, status_code: int, started: float) -> None:
+    duration_ms = round((time.perf_counter() - started) * 1000, 3)
+    access_logger.info("%s %s %s", request.method, request.url.path, status_code,
+                       extra={"method": request.method, "path": request.url.path,
+                              "status_code": status_code, "duration_ms": duration_ms})
+
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(status_code=503, content={"detail": "Database is temporarily unavailable."})
 
 
 @app.get("/currencies", summary="List Currencies",
-         description="Returns a list of available currencies, their current exchange rates and names from DB.")
-async def read_currencies(session: AsyncSession = Depends(get_session)):
+         description="Returns a list of available currencies, their current exchange rates and names from DB. "
+                     "Supports JSON and MessagePack (Accept header), gzip and brotli (Accept-Encoding header).")
+async def read_currencies(request: Request, repository: CurrencyRepository = Depends(get_repository)):
     """
     Endpoint to read all available currencies from the database.
 
-    :param AsyncSession session: Dependency injection of the database session for performing asynchronous DB operations.
-    :return: JSON list of all currencies.
+    Encoded responses are cached per rates version (the last update time), so every representation
+    is produced once per rates update.
+
+    :param Request request: The incoming request used for content negotiation.
+    :param CurrencyRepository repository: Dependency injection of the repository of the configured storage backend.
+    :return: List of all currencies in the negotiated representation.
     """
-    currencies = await get_currencies(session)
-    return currencies
+    version = await get_last_update_time(repository)
+    return await negotiated_response(request, lambda: get_currencies(repository),
+                                     version=version, cache=currencies_response_cache)
 
 
 @app.get("/last-update-time", summary="Get Last DB Update Time",
          description="Retrieves the last time the exchange rates were updated in the database.",
          response_description="The last update time of the exchange rates.")
-async def read_last_update_time(session: AsyncSession = Depends(get_session)):
+async def read_last_update_time(repository: CurrencyRepository = Depends(get_repository)):
     """
     Retrieves the last time the exchange rates were updated in the database.
 
-    :param AsyncSession session: Dependency injection of the database session for performing asynchronous DB operations.
+    :param CurrencyRepository repository: Dependency injection of the repository of the configured storage backend.
     :return: JSON response containing the last update time in 'dd-MMM-yyyy HH:mm' format if found.
     :rtype: dict
     :raises HTTPException: 404 error if last update time not found.
     """
-    last_update_time = await get_last_update_time(session)
+    last_update_time = await get_last_update_time(repository)
     if last_update_time:
         return {"last_update_time": last_update_time.strftime("%d-%b-%Y %H:%M")}
     else:
@@ -52,11 +123,11 @@ async def read_last_update_time(session: AsyncSession = Depends(get_session)):
           description="Updates the exchange rates in the database with current rates from an external API.",
           responses={200: {"description": "Exchange rates updated successfully."},
                      500: {"description": "Internal server error."}})
-async def update_rates(session: AsyncSession = Depends(get_session)):
+async def update_rates(repository: CurrencyRepository = Depends(get_repository)):
     """
     Endpoint to update exchange rates in the database with current rates from an external API.
 
-    :param AsyncSession session: Dependency injection of the database session for performing asynchronous DB operations.
+    :param CurrencyRepository repository: Dependency injection of the repository of the configured storage backend.
     :return: JSON response with a success message if the rates are updated successfully.
     :rtype: dict
     :raises HTTPException: 500 error with detail of the exception in case of failure during rates update.
@@ -65,7 +136,7 @@ async def update_rates(session: AsyncSession = Depends(get_session)):
         # Get new rates
         rates = await fetch_current_exchange_rates(Config.API_KEY)
         # Update existing rates in db
-        await update_exchange_rates(session, rates)
+        await update_exchange_rates(repository, rates)
         return {"message": "Exchange rates updated successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"{e}")
@@ -79,25 +150,70 @@ class ConvertOutput(BaseModel):
          description="Converts a specified amount from a source currency to a target currency.",
          response_model=ConvertOutput,
          responses={400: {"description": "Invalid input parameters."}})
-async def convert_endpoint(source: str, target: str, amount: float, session: AsyncSession = Depends(get_session)):
+async def convert_endpoint(source: str, target: str, amount: float,
+                           repository: CurrencyRepository = Depends(get_repository)):
     """
     Converts a specified amount from a source currency to a target currency using the latest exchange rates.
 
     :param str source: The ISO currency code for the source currency.
     :param str target: The ISO currency code for the target currency.
     :param float amount: The amount of the source currency to convert.
-    :param AsyncSession session: Dependency injection of the database session for performing asynchronous DB operations.
+    :param CurrencyRepository repository: Dependency injection of the repository of the configured storage backend.
     :return: JSON response containing the converted amount if the conversion is successful.
     :rtype: dict
     :raises HTTPException: 400 error with detail of the exception if conversion cannot be performed.
     """
     try:
-        result = await convert_currency(session, source, target, amount)
+        result = await convert_currency(repository, source, target, amount)
         return {"converted_amount": result}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"{e}")
 
 
+class BulkConversion(BaseModel):
+    amount: float = Field(..., description="Amount in the source currency")
+    source: str = Field(..., description="ISO code of the source currency")
+    target: str = Field(..., description="ISO code of the target currency")
+    timestamp: datetime = Field(..., description="Moment of the rates to use. Naive timestamps are in UTC.")
+
+
+class BulkConvertInput(BaseModel):
+    conversions: list[BulkConversion] = Field(..., max_length=Config.BULK_CONVERT_MAX_ROWS)
+
+
+class BulkConvertOutput(BaseModel):
+    converted_amounts: list[float] = Field(..., description="Converted amounts in the order of the conversions")
+
+
+@app.post("/convert/bulk", summary="Bulk Convert Currency As Of Timestamps",
+          description="Converts many amounts, each one with the exchange rates valid at its own timestamp. "
+                      "Supports the same content negotiation as /currencies.",
+          response_model=BulkConvertOutput,
+          responses={400: {"description": "Invalid input parameters."}})
+async def bulk_convert_endpoint(request: Request, data: BulkConvertInput,
+                                repository: CurrencyRepository = Depends(get_repository)):
+    """
+    Converts many amounts using historical exchange rates valid at the timestamp of every conversion.
+
+    :param Request request: The incoming request used for content negotiation.
+    :param BulkConvertInput data: The conversions to perform.
+    :param CurrencyRepository repository: Dependency injection of the repository of the configured storage backend.
+    :return: Response containing the converted amounts in the order of the conversions.
+    :raises HTTPException: 400 error with detail of the exception if a conversion cannot be performed.
+    """
+    conversions = [(conversion.amount, conversion.source, conversion.target, conversion.timestamp)
+                   for conversion in data.conversions]
+    try:
+        converted_amounts = await convert_currencies_as_of(repository, conversions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+
+    async def load_payload():
+        return {"converted_amounts": converted_amounts}
+
+    return await negotiated_response(request, load_payload)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,193 @@
+import gzip
+import json
+from decimal import Decimal
+from typing import Awaitable, Callable, Hashable, Optional
+
+import brotli
+import msgpack
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Supported representations in the order of server preference
+MEDIA_TYPES = (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+ENCODINGS = ("br", "gzip", "identity")
+
+# Compressing tiny bodies costs more CPU than it saves bandwidth
+MINIMUM_COMPRESSION_SIZE = 500
+
+# Default levels (brotli 11, gzip 9) are too slow for bodies encoded per request, these are close in size
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def _parse_header(header: Optional[str]) -> dict:
+    """
+    Parses Accept like header into a dictionary of values to their quality.
+    """
+    qualities = {}
+    for item in (header or "").split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, q = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        qualities[value.lower()] = quality
+    return qualities
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    Selects the representation for the Accept header. JSON is used when nothing supported is accepted.
+
+    :param accept: Value of the Accept request header.
+    :return: The selected media type.
+    """
+    qualities = _parse_header(accept)
+    if not qualities:
+        return JSON_MEDIA_TYPE
+
+    def quality(media_type: str) -> float:
+        main_type = media_type.split("/")[0]
+        for candidate in (media_type, f"{main_type}/*", "*/*"):
+            if candidate in qualities:
+                return qualities[candidate]
+        return 0.0
+
+    best = max(MEDIA_TYPES, key=lambda media_type: (quality(media_type), -MEDIA_TYPES.index(media_type)))
+    if quality(best) <= 0:
+        return JSON_MEDIA_TYPE
+    # Both msgpack media types share one representation
+    return MSGPACK_MEDIA_TYPE if best != JSON_MEDIA_TYPE else JSON_MEDIA_TYPE
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """
+    Selects the content coding for the Accept-Encoding header.
+
+    :param accept_encoding: Value of the Accept-Encoding request header.
+    :return: "br", "gzip" or "identity".
+    """
+    qualities = _parse_header(accept_encoding)
+
+    def quality(encoding: str) -> float:
+        if encoding in qualities:
+            return qualities[encoding]
+        if "*" in qualities:
+            return qualities["*"]
+        # identity is always acceptable unless explicitly refused
+        return 1.0 if encoding == "identity" else 0.0
+
+    best = max(ENCODINGS, key=lambda encoding: (quality(encoding), -ENCODINGS.index(encoding)))
+    return best if quality(best) > 0 else "identity"
+
+
+def serialize(payload, media_type: str) -> bytes:
+    """
+    Serializes payload into the given representation. Decimals are written as floats.
+    """
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+class EncodedResponseCache:
+    """
+    Keeps encoded bodies of a single rates version.
+
+    Every (media type, encoding) representation is produced once per version. Entries of older versions
+    are dropped as soon as a new version is stored.
+    """
+
+    def __init__(self):
+        self.version: Optional[Hashable] = None
+        self.entries = {}
+
+    def get(self, version: Hashable, key: tuple) -> Optional[tuple]:
+        if version != self.version:
+            return None
+        return self.entries.get(key)
+
+    def set(self, version: Hashable, key: tuple, entry: tuple) -> None:
+        if version != self.version:
+            self.version = version
+            self.entries = {}
+        self.entries[key] = entry
+
+    def clear(self) -> None:
+        self.version = None
+        self.entries = {}
+
+
+async def _encode(load_payload: Callable[[], Awaitable], media_type: str, encoding: str,
+                  version: Optional[Hashable], cache: Optional[EncodedResponseCache]) -> tuple:
+    """
+    Returns (body, applied encoding) of the payload, taking both from the cache when possible.
+
+    Serialization and compression are CPU bound, so they run in the threadpool instead of the event loop.
+    """
+    use_cache = cache is not None and version is not None
+    entry = cache.get(version, (media_type, encoding)) if use_cache else None
+    if entry is not None:
+        return entry
+
+    # Serialized body is shared between all encodings of the same representation
+    raw_entry = cache.get(version, (media_type, "identity")) if use_cache else None
+    if raw_entry is None:
+        payload = await load_payload()
+        raw_entry = (await run_in_threadpool(serialize, payload, media_type), "identity")
+        if use_cache:
+            cache.set(version, (media_type, "identity"), raw_entry)
+
+    raw_body = raw_entry[0]
+    if encoding == "identity" or len(raw_body) < MINIMUM_COMPRESSION_SIZE:
+        entry = raw_entry
+    else:
+        entry = (await run_in_threadpool(compress, raw_body, encoding), encoding)
+    if use_cache:
+        cache.set(version, (media_type, encoding), entry)
+    return entry
+
+
+async def negotiated_response(request: Request, load_payload: Callable[[], Awaitable],
+                              version: Optional[Hashable] = None,
+                              cache: Optional[EncodedResponseCache] = None) -> Response:
+    """
+    Builds a response in the representation and content coding requested by the client.
+
+    :param Request request: The incoming request with Accept and Accept-Encoding headers.
+    :param load_payload: Coroutine function returning the payload. It is not called on cache hits.
+    :param version: Version of the data behind the payload. Responses without version are not cached.
+    :param EncodedResponseCache cache: Cache for the encoded bodies of the endpoint.
+    :return: Response with the encoded body.
+    """
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    body, applied_encoding = await _encode(load_payload, media_type, encoding, version, cache)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if applied_encoding != "identity":
+        headers["Content-Encoding"] = applied_encoding
+    return Response(content=body, media_type=media_type, headers=headers)
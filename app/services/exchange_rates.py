@@ -25,6 +25,6 @@ async def fetch_current_exchange_rates(api_key: str) -> dict:
             data = response.json()
             return data['rates']
         except KeyError as e:
-            logger.error(f"An error occurred: {e}", exc_info=True)
+            logger.error("An error occurred: %s", e, exc_info=True)
             raise ValueError(f"The response from the API does not contain 'rates'. Response was: {response.text}")
 
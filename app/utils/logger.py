@@ -1,4 +1,153 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
\ No newline at end of file
+from app.config import Config
+
+# ID of the request being handled, added to every record logged while handling it
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes of every LogRecord, the rest are extra fields passed by the caller
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single line JSON objects. Extra fields of the record (e.g. duration_ms) are included.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        data.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Puts records into the queue without blocking the event loop.
+
+    Unlike QueueHandler, records are not formatted here: tracebacks are formatted by the background writer.
+    Records are dropped if the queue is full, so a slow output never stalls the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        # Merge arguments now, they could be changed before the writer gets the record
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Called under the handler lock, see `take_dropped`
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """
+        Returns the number of records dropped since the previous call.
+        """
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class DropReportingQueueListener(QueueListener):
+    """
+    Queue listener that logs a warning with the number of records dropped by the queue handler.
+
+    The warning is written at most once per `report_interval` seconds while records are dropped
+    and once more when the listener stops.
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers, queue_handler: ContextQueueHandler,
+                 report_interval: float = 10.0, respect_handler_level: bool = False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.queue_handler = queue_handler
+        self.report_interval = report_interval
+        self.reported_at = time.monotonic()
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            if time.monotonic() - self.reported_at >= self.report_interval:
+                self.report_dropped()
+            try:
+                # Wake up periodically to report drops even if nothing else is logged
+                return self.queue.get(block, timeout=self.report_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+
+    def report_dropped(self) -> None:
+        self.reported_at = time.monotonic()
+        dropped = self.queue_handler.take_dropped()
+        if dropped:
+            self.handle(logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                          "Dropped %d log records, the log queue is full", (dropped,), None))
+
+    def enqueue_sentinel(self) -> None:
+        # The queue can be full, wait for the writer to free a slot instead of failing on stop
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        super().stop()
+        self.report_dropped()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only the given share of records. Used for high volume access logs.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+queue_handler = ContextQueueHandler(log_queue)
+
+stream_handler = logging.StreamHandler(sys.stdout)
+stream_handler.setFormatter(JsonFormatter())
+log_listener = DropReportingQueueListener(log_queue, stream_handler, queue_handler=queue_handler,
+                                          respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+root_logger.handlers = [queue_handler]
+root_logger.setLevel(Config.LOG_LEVEL)
+
+# Uvicorn loggers write to the same queue instead of their own stream handlers
+for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+    logging.getLogger(name).handlers = []
+    logging.getLogger(name).propagate = True
+
+logger = logging.getLogger(__name__)
+
+access_logger = logging.getLogger("app.access")
+access_logger.addFilter(SamplingFilter(Config.LOG_ACCESS_SAMPLE_RATE))
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.db.currency_operations import database_breaker, bulk_history_breaker
+from app.db.notifier import LocalRatesNotifier
+from app.db.rates_cache import rates_cache
+from app.db.repository import InMemoryCurrencyRepository
+from app.main import currencies_response_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Process wide caches and breaker state must not leak between tests using different repositories
+    rates_cache.clear()
+    currencies_response_cache.clear()
+    database_breaker.reset()
+    bulk_history_breaker.reset()
+    yield
+    rates_cache.clear()
+    currencies_response_cache.clear()
+    database_breaker.reset()
+    bulk_history_breaker.reset()
+
+
+@pytest.fixture
+def notifier() -> LocalRatesNotifier:
+    return LocalRatesNotifier()
+
+
+@pytest.fixture
+def repository(notifier: LocalRatesNotifier) -> InMemoryCurrencyRepository:
+    # Small EUR based storage, endpoint tests override it with the initial migration data
+    return InMemoryCurrencyRepository([{'name': 'Euro', 'code': 'EUR', 'rate': 1},
+                                       {'name': 'United States Dollar', 'code': 'USD', 'rate': 1.25}],
+                                      datetime(2024, 2, 20, tzinfo=timezone.utc), notifier)
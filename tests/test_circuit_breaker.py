@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app.db.circuit_breaker import CircuitBreaker, CircuitBreakerOpen
+
+
+async def failing_call():
+    raise OSError("Connection refused")
+
+
+async def successful_call():
+    return "ok"
+
+
+async def hanging_call():
+    await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    for _ in range(2):
+        with pytest.raises(OSError):
+            await breaker.call(failing_call)
+
+    assert breaker.is_open
+    # Open breaker fails fast without calling the database
+    with pytest.raises(CircuitBreakerOpen):
+        await breaker.call(successful_call)
+
+
+@pytest.mark.asyncio
+async def test_breaker_closes_after_successful_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+
+    with pytest.raises(OSError):
+        await breaker.call(failing_call)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Reset timeout is passed, the trial call is let through
+    assert await breaker.call(successful_call) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_breaker_reopens_after_failed_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+
+    with pytest.raises(OSError):
+        await breaker.call(failing_call)
+    with pytest.raises(OSError):
+        await breaker.call(failing_call)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_breaker_call_timeout_is_failure():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, call_timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await breaker.call(hanging_call)
+
+    assert breaker.is_open
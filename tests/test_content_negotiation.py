@@ -0,0 +1,29 @@
+import pytest
+
+from app.services.content_negotiation import negotiate_media_type, negotiate_encoding
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, "application/json"),
+    ("*/*", "application/json"),
+    ("application/msgpack", "application/msgpack"),
+    ("application/x-msgpack", "application/msgpack"),
+    ("application/json;q=0.5, application/msgpack", "application/msgpack"),
+    ("application/msgpack;q=0, application/*", "application/json"),
+    ("text/html", "application/json"),
+])
+def test_negotiate_media_type(accept, expected):
+    assert negotiate_media_type(accept) == expected
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, "identity"),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("*", "br"),
+    ("br;q=0, *", "gzip"),
+    ("deflate", "identity"),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
@@ -0,0 +1,76 @@
+import json
+import logging
+import queue
+
+from app.utils.logger import JsonFormatter, ContextQueueHandler, SamplingFilter, DropReportingQueueListener, \
+    request_id_var
+
+
+def make_record(msg: str = "Converted %s", args: tuple = ("EUR",), exc_info=None, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("app.test", logging.INFO, __file__, 1, msg, args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    record = make_record(request_id="abc", duration_ms=1.5)
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["message"] == "Converted EUR"
+    assert data["level"] == "INFO"
+    assert data["request_id"] == "abc"
+    assert data["duration_ms"] == 1.5
+
+
+def test_queue_handler_defers_traceback_formatting():
+    log_queue = queue.Queue()
+    handler = ContextQueueHandler(log_queue)
+    try:
+        raise ValueError("No rates")
+    except ValueError as e:
+        exc_info = (type(e), e, e.__traceback__)
+
+    token = request_id_var.set("abc")
+    try:
+        handler.handle(make_record(exc_info=exc_info))
+    finally:
+        request_id_var.reset(token)
+
+    record = log_queue.get_nowait()
+    assert record.request_id == "abc"
+    assert record.msg == "Converted EUR"
+    # Traceback is formatted later by the background writer
+    assert record.exc_info == exc_info
+    assert record.exc_text is None
+    assert "ValueError: No rates" in json.loads(JsonFormatter().format(record))["exc_info"]
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = ContextQueueHandler(queue.Queue(maxsize=1))
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert handler.dropped == 1
+
+
+def test_listener_reports_dropped_records():
+    log_queue = queue.Queue(maxsize=1)
+    handler = ContextQueueHandler(log_queue)
+    output = queue.Queue()
+    listener = DropReportingQueueListener(log_queue, ContextQueueHandler(output), queue_handler=handler)
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+    listener.start()
+    listener.stop()
+
+    messages = [output.get_nowait().getMessage() for _ in range(output.qsize())]
+    assert messages == ["Converted EUR", "Dropped 1 log records, the log queue is full"]
+    assert handler.dropped == 0
+
+
+def test_sampling_filter():
+    assert all(SamplingFilter(1).filter(make_record()) for _ in range(100))
+    assert not any(SamplingFilter(0).filter(make_record()) for _ in range(100))
@@ -1,18 +1,33 @@
 import asyncio
+import time
 from datetime import timezone
 
+import msgpack
 import pytest
 from httpx import AsyncClient
 from pytest_mock import MockerFixture
 
 from app import app
+from app.config import Config
+from app.db.currency_operations import database_breaker
+from app.db.engine import get_repository
 from app.db.migrations.initial_currencies import last_update_time
+from app.db.rates_cache import rates_cache
+from app.db.repository import InMemoryCurrencyRepository
 
 
 @pytest.fixture
-async def client() -> AsyncClient:
+def repository() -> InMemoryCurrencyRepository:
+    # Run endpoints against the in-memory storage seeded with the initial migration data
+    return InMemoryCurrencyRepository.from_initial_data()
+
+
+@pytest.fixture
+async def client(repository: InMemoryCurrencyRepository) -> AsyncClient:
+    app.dependency_overrides[get_repository] = lambda: repository
     async with AsyncClient(app=app, base_url="http://test") as client:
         yield client
+    app.dependency_overrides.clear()
 
 
 @pytest.fixture(scope="session")
@@ -52,6 +67,16 @@ async def test_convert_endpoint_success(client: AsyncClient, mocker: MockerFixtu
     assert response.json() == {"converted_amount": 50}
 
 
+@pytest.mark.asyncio
+async def test_request_id_header(client: AsyncClient):
+    response = await client.get("/last-update-time", headers={"X-Request-ID": "reconciliation-42"})
+    assert response.headers["x-request-id"] == "reconciliation-42"
+
+    # ID is generated if the client does not send it
+    response = await client.get("/last-update-time")
+    assert response.headers["x-request-id"]
+
+
 @pytest.mark.asyncio
 async def test_convert_bad_currency(client: AsyncClient):
     # UNKNOWN is bad currency name
@@ -59,3 +84,149 @@ async def test_convert_bad_currency(client: AsyncClient):
     assert response.status_code == 400
     assert response.json() == {"detail": "Currency UNKNOWN is not available."}
 
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+async def test_read_currencies_compressed(client: AsyncClient, encoding: str):
+    response = await client.get("/currencies", headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == encoding
+
+    # httpx decodes the body transparently
+    currencies = response.json()
+    assert {"rate": 1.0, "code": "EUR", "name": "Euro"} in currencies
+
+
+@pytest.mark.asyncio
+async def test_read_currencies_msgpack(client: AsyncClient):
+    response = await client.get("/currencies", headers={"Accept": "application/msgpack"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert {"rate": 1.0, "code": "EUR", "name": "Euro"} in msgpack.unpackb(response.content)
+
+
+@pytest.mark.asyncio
+async def test_read_currencies_encoded_once_per_version(client: AsyncClient, mocker: MockerFixture):
+    get_currencies = mocker.patch("app.main.get_currencies", return_value=[{"rate": 1, "code": "EUR", "name": "Euro"}])
+
+    for encoding in ["gzip", "br", "identity", "gzip"]:
+        response = await client.get("/currencies", headers={"Accept-Encoding": encoding})
+        assert response.json() == [{"rate": 1, "code": "EUR", "name": "Euro"}]
+
+    # Serialized body is shared by all encodings of the same rates version
+    assert get_currencies.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_convert_serves_stale_rates(client: AsyncClient, repository: InMemoryCurrencyRepository,
+                                          mocker: MockerFixture):
+    # Load last-known-good rates
+    response = await client.get("/convert?source=EUR&target=USD&amount=100")
+    assert response.status_code == 200
+    assert "warning" not in response.headers
+
+    # Rates are updated on another node, then the database goes down
+    rates_cache.invalidate()
+    mocker.patch.object(repository, "get_last_update_time", side_effect=OSError("Connection refused"))
+
+    stale_response = await client.get("/convert?source=EUR&target=USD&amount=100")
+    assert stale_response.status_code == 200
+    assert stale_response.json() == response.json()
+    assert stale_response.headers["warning"] == '110 - "Response is Stale"'
+    assert "age" in stale_response.headers
+
+
+@pytest.mark.asyncio
+async def test_convert_stale_rates_max_age(client: AsyncClient, mocker: MockerFixture):
+    await client.get("/convert?source=EUR&target=USD&amount=100")
+
+    rates_cache.invalidate()
+    mocker.patch("app.db.currency_operations.Config.STALE_RATES_MAX_AGE", -1)
+    database_breaker.state = database_breaker.OPEN
+    database_breaker.opened_at = time.monotonic()
+
+    # Rates are too old and the database is unavailable
+    response = await client.get("/convert?source=EUR&target=USD&amount=100")
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Database is temporarily unavailable."}
+
+
+@pytest.mark.asyncio
+async def test_bulk_convert_endpoint(client: AsyncClient):
+    response = await client.post("/convert/bulk", json={"conversions": [
+        {"amount": 100, "source": "EUR", "target": "USD", "timestamp": "2024-03-01T00:00:00Z"},
+        {"amount": 100, "source": "EUR", "target": "EUR", "timestamp": "2024-03-01T00:00:00Z"},
+    ]})
+    assert response.status_code == 200
+    assert response.json() == {"converted_amounts": [108.1075, 100.0]}
+
+
+@pytest.mark.asyncio
+async def test_bulk_convert_before_history(client: AsyncClient):
+    response = await client.post("/convert/bulk", json={"conversions": [
+        {"amount": 100, "source": "EUR", "target": "USD", "timestamp": "2020-01-01T00:00:00Z"},
+    ]})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("url", ["/convert?source=EUR&target=USD&amount=100", "/currencies", "/last-update-time"])
+async def test_database_error_without_cache(client: AsyncClient, repository: InMemoryCurrencyRepository,
+                                            mocker: MockerFixture, url: str):
+    # Nothing is loaded yet and the database fails before the breaker opens
+    mocker.patch.object(repository, "get_last_update_time", side_effect=OSError("Connection refused"))
+
+    response = await client.get(url)
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Database is temporarily unavailable."}
+
+
+@pytest.mark.asyncio
+async def test_database_error_with_too_old_cache(client: AsyncClient, repository: InMemoryCurrencyRepository,
+                                                 mocker: MockerFixture):
+    await client.get("/convert?source=EUR&target=USD&amount=100")
+
+    rates_cache.invalidate()
+    mocker.patch("app.db.currency_operations.Config.STALE_RATES_MAX_AGE", -1)
+    mocker.patch.object(repository, "get_last_update_time", side_effect=OSError("Connection refused"))
+
+    response = await client.get("/convert?source=EUR&target=USD&amount=100")
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_bulk_convert_row_limit(client: AsyncClient):
+    conversion = {"amount": 100, "source": "EUR", "target": "USD", "timestamp": "2024-03-01T00:00:00Z"}
+    response = await client.post("/convert/bulk",
+                                 json={"conversions": [conversion] * (Config.BULK_CONVERT_MAX_ROWS + 1)})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_bulk_convert_slow_history_keeps_read_breaker_closed(client: AsyncClient,
+                                                                   repository: InMemoryCurrencyRepository,
+                                                                   mocker: MockerFixture):
+    mocker.patch.object(repository, "get_rate_history", side_effect=asyncio.TimeoutError())
+    conversion = {"amount": 100, "source": "EUR", "target": "USD", "timestamp": "2024-03-01T00:00:00Z"}
+
+    for _ in range(Config.DB_FAILURE_THRESHOLD):
+        response = await client.post("/convert/bulk", json={"conversions": [conversion]})
+        assert response.status_code == 503
+
+    # Failed bulk history reads do not affect regular conversions
+    assert database_breaker.state == database_breaker.CLOSED
+    response = await client.get("/convert?source=EUR&target=USD&amount=100")
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_unhandled_error_is_access_logged(client: AsyncClient, mocker: MockerFixture):
+    mocker.patch("app.main.get_last_update_time", side_effect=RuntimeError("Unexpected"))
+    access_log = mocker.patch("app.main.access_logger.info")
+
+    with pytest.raises(RuntimeError):
+        await client.get("/last-update-time", headers={"X-Request-ID": "failing-1"})
+
+    extra = access_log.call_args.kwargs["extra"]
+    assert extra["status_code"] == 500
+    assert "duration_ms" in extra
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import asyncpg
+import pytest
+from pytest_mock import MockerFixture
+
+from app.db.notifier import LocalRatesNotifier, PostgresRatesNotifier, RatesUpdateEvent
+from app.db.rates_cache import RatesCache
+from app.db.repository import InMemoryCurrencyRepository
+
+
+@pytest.mark.asyncio
+async def test_update_invalidates_every_worker(repository: InMemoryCurrencyRepository, notifier: LocalRatesNotifier):
+    # Two caches stand for two workers sharing one storage
+    workers = [RatesCache(), RatesCache()]
+    for cache in workers:
+        await cache.track(notifier)
+        await cache.refresh(repository)
+        assert cache.is_fresh
+
+    await repository.update_rates({'USD': 2}, datetime(2024, 2, 21, tzinfo=timezone.utc))
+
+    for cache in workers:
+        assert not cache.is_fresh
+        await cache.refresh(repository)
+        assert cache.currencies['USD']['rate'] == Decimal('2')
+        assert cache.last_updated == datetime(2024, 2, 21, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_event_of_loaded_version_is_skipped(repository: InMemoryCurrencyRepository):
+    cache = RatesCache()
+    await cache.refresh(repository)
+
+    cache.on_rates_updated(RatesUpdateEvent(version=datetime(2024, 2, 20, tzinfo=timezone.utc).isoformat()))
+    assert cache.is_fresh
+
+    # None means notifications could have been missed
+    cache.on_rates_updated(None)
+    assert not cache.is_fresh
+
+
+@pytest.mark.asyncio
+async def test_load_racing_with_update_stays_stale(repository: InMemoryCurrencyRepository):
+    cache = RatesCache()
+    get_currencies = repository.get_currencies
+
+    async def get_currencies_with_update():
+        # Update is committed while the cache is loading
+        cache.on_rates_updated(RatesUpdateEvent(version="2024-02-21T00:00:00+00:00", codes=['USD']))
+        return await get_currencies()
+
+    repository.get_currencies = get_currencies_with_update
+    await cache.refresh(repository)
+    assert not cache.is_fresh
+
+
+@pytest.mark.asyncio
+async def test_waiting_callers_share_load_while_not_listening(repository: InMemoryCurrencyRepository):
+    cache = RatesCache()
+    # LISTEN connection is not made yet, so the data is never fresh
+    cache.notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db")
+    get_currencies = repository.get_currencies
+    loads = 0
+
+    async def slow_get_currencies():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)
+        return await get_currencies()
+
+    repository.get_currencies = slow_get_currencies
+    await asyncio.gather(*(cache.refresh(repository) for _ in range(60)))
+
+    assert loads == 1
+    assert not cache.is_fresh
+
+    # Later callers do not trust the data and load it again
+    await cache.refresh(repository)
+    assert loads == 2
+
+
+def test_rates_update_event_payload():
+    event = RatesUpdateEvent(version="2024-02-21T00:00:00+00:00", codes=['EUR', 'USD'])
+    assert RatesUpdateEvent.from_payload(event.to_payload()) == event
+
+
+def test_postgres_notifier_dsn():
+    notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db")
+    assert notifier.dsn == "postgresql://postgres:postgres@db/api_db"
+    # Local data is not trusted until the LISTEN connection is made
+    assert not notifier.is_listening
+
+
+@pytest.mark.asyncio
+async def test_postgres_notifier_retries_any_connect_error(mocker: MockerFixture):
+    notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db", reconnect_delay=0)
+    connection = mocker.AsyncMock()
+    connection.add_listener.side_effect = [asyncpg.InterfaceError("Connection is not ready"), None]
+    connection.add_termination_listener = mocker.Mock()
+    connection.is_closed = mocker.Mock(return_value=False)
+    mocker.patch("app.db.notifier.asyncpg.connect", return_value=connection)
+
+    await notifier._reconnect()
+
+    # Connection of the failed attempt is closed, the next attempt succeeds
+    assert connection.close.await_count == 1
+    assert notifier.is_listening
+
+
+@pytest.mark.asyncio
+async def test_postgres_notifier_reconnects_after_failed_check(mocker: MockerFixture):
+    notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db", reconnect_delay=0,
+                                     check_interval=0, check_timeout=0.01)
+
+    async def hang(query):
+        await asyncio.sleep(10)
+
+    # First connection is half-open: it looks open, but queries never get an answer
+    half_open, healthy = mocker.AsyncMock(), mocker.AsyncMock()
+    half_open.fetchval.side_effect = hang
+    for connection in (half_open, healthy):
+        connection.add_termination_listener = mocker.Mock()
+        connection.terminate = mocker.Mock()
+        connection.is_closed = mocker.Mock(return_value=False)
+    mocker.patch("app.db.notifier.asyncpg.connect", side_effect=[half_open, healthy])
+    events = []
+    notifier.listeners.append(events.append)
+
+    await notifier._reconnect()
+    assert notifier.connection is half_open
+    await asyncio.sleep(0.05)
+
+    half_open.terminate.assert_called_once()
+    assert notifier.connection is healthy
+    # Lost connection and the new one both mean notifications could have been missed
+    assert events == [None, None, None]
+    await notifier.close()
+
+
+@pytest.mark.asyncio
+async def test_postgres_notification_invalidates_cache(repository: InMemoryCurrencyRepository, mocker: MockerFixture):
+    notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db")
+    session = mocker.AsyncMock()
+    event = RatesUpdateEvent(version="2024-02-21T00:00:00+00:00", codes=['USD'])
+    await notifier.publish_in_transaction(session, event)
+    payload = session.execute.call_args.args[1]["payload"]
+
+    cache = RatesCache()
+    notifier.listeners.append(cache.on_rates_updated)
+    await cache.refresh(repository)
+    assert not cache.stale
+
+    # Postgres delivers the payload sent in the update transaction
+    notifier._on_notification(None, 1, "currency_rates", payload)
+    assert cache.stale
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("payload", ["not json", "[1, 2]", "{}"])
+async def test_invalid_postgres_notification_invalidates_cache(repository: InMemoryCurrencyRepository,
+                                                               payload: str):
+    notifier = PostgresRatesNotifier("postgresql+asyncpg://postgres:postgres@db/api_db")
+    cache = RatesCache()
+    notifier.listeners.append(cache.on_rates_updated)
+    await cache.refresh(repository)
+
+    notifier._on_notification(None, 1, "currency_rates", payload)
+    assert cache.stale
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.db.currency_operations import convert_currency, update_exchange_rates, get_last_update_time, \
+    convert_currencies_as_of, get_currency_rate, database_breaker, track_staleness
+from app.db.rates_cache import rates_cache
+from app.db.repository import InMemoryCurrencyRepository
+
+
+@pytest.mark.asyncio
+async def test_in_memory_convert_currency(repository: InMemoryCurrencyRepository):
+    converted_amount = await convert_currency(repository, 'USD', 'EUR', 100)
+    assert converted_amount == Decimal('80')
+
+
+@pytest.mark.asyncio
+async def test_in_memory_update_exchange_rates(repository: InMemoryCurrencyRepository):
+    # Unknown currencies are ignored, the same as in SQL storage
+    await update_exchange_rates(repository, {'USD': 2, 'XXX': 3})
+
+    assert await get_currency_rate(repository, 'USD') == Decimal('2')
+    with pytest.raises(ValueError):
+        await get_currency_rate(repository, 'XXX')
+    assert await get_last_update_time(repository) > datetime(2024, 2, 20, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_in_memory_unknown_currency(repository: InMemoryCurrencyRepository):
+    with pytest.raises(ValueError, match="Currency UNKNOWN is not available."):
+        await convert_currency(repository, 'UNKNOWN', 'EUR', 100)
+
+
+@pytest.mark.asyncio
+async def test_in_memory_convert_currencies_as_of(repository: InMemoryCurrencyRepository):
+    await repository.update_rates({'USD': 2}, datetime(2024, 3, 1, tzinfo=timezone.utc))
+
+    converted_amounts = await convert_currencies_as_of(repository, [
+        (100, 'EUR', 'USD', datetime(2024, 3, 2, tzinfo=timezone.utc)),
+        (100, 'EUR', 'USD', datetime(2024, 2, 25)),
+        (100, 'USD', 'EUR', datetime(2024, 3, 1, tzinfo=timezone.utc)),
+    ])
+
+    # Results keep the order of the conversions
+    assert converted_amounts == [Decimal('200'), Decimal('125'), Decimal('50')]
+
+
+@pytest.mark.asyncio
+async def test_in_memory_convert_currencies_before_history(repository: InMemoryCurrencyRepository):
+    with pytest.raises(ValueError, match="Currency EUR is not available at 2024-01-01T00:00:00\\+00:00."):
+        await convert_currencies_as_of(repository, [(100, 'EUR', 'USD', datetime(2024, 1, 1))])
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_slow_loads_is_not_database_failure(repository: InMemoryCurrencyRepository,
+                                                              mocker: MockerFixture):
+    mocker.patch.object(database_breaker, "call_timeout", 0.1)
+    mocker.patch.object(database_breaker, "failure_threshold", 1)
+    get_currencies = repository.get_currencies
+    loads = 0
+
+    async def slow_get_currencies():
+        nonlocal loads
+        loads += 1
+        if loads == 1:
+            # Rates are updated during the first load, so the waiting readers load them again
+            rates_cache.invalidate()
+        await asyncio.sleep(0.06)
+        return await get_currencies()
+
+    repository.get_currencies = slow_get_currencies
+
+    async def read_rate():
+        with track_staleness() as staleness:
+            rate = await get_currency_rate(repository, 'USD')
+        return rate, staleness
+
+    # Readers wait for two loads, longer than the breaker timeout of a single load
+    results = await asyncio.gather(*(read_rate() for _ in range(10)))
+
+    assert loads == 2
+    assert results == [(Decimal('1.25'), {})] * 10
+    assert database_breaker.state == database_breaker.CLOSED
@@ -0,0 +1,86 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from pytest_mock import MockerFixture
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.engine import init_storage
+from app.db.migrations.initial_currencies import initial_currencies, last_update_time
+from app.db.notifier import PollingRatesNotifier, RatesUpdateEvent
+from app.db.repository import SQLAlchemyCurrencyRepository
+
+
+@pytest.fixture
+async def sqlite_session(tmp_path, mocker: MockerFixture) -> AsyncSession:
+    # init_storage prepares the module engine of the configured backend, point both to a temporary SQLite file
+    sqlite_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'currency.db'}", future=True)
+    mocker.patch("app.db.engine.engine", sqlite_engine)
+    mocker.patch("app.db.engine.Config.STORAGE_BACKEND", "sqlite")
+
+    await init_storage()
+    # Second start must not seed the data again
+    await init_storage()
+
+    async_session = sessionmaker(sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+    async with async_session() as session:
+        yield session
+    await sqlite_engine.dispose()
+
+
+@pytest.fixture
+def sqlite_repository(sqlite_session: AsyncSession) -> SQLAlchemyCurrencyRepository:
+    return SQLAlchemyCurrencyRepository(sqlite_session)
+
+
+@pytest.mark.asyncio
+async def test_init_storage_seeds_initial_currencies(sqlite_repository: SQLAlchemyCurrencyRepository):
+    currencies = await sqlite_repository.get_currencies()
+
+    assert len(currencies) == len(initial_currencies)
+    assert {"rate": Decimal("1"), "code": "EUR", "name": "Euro"} in currencies
+    assert await sqlite_repository.get_last_update_time() == last_update_time
+
+
+@pytest.mark.asyncio
+async def test_update_rates(sqlite_repository: SQLAlchemyCurrencyRepository):
+    updated_at = datetime(2024, 3, 1)
+
+    # Unknown currencies are ignored
+    await sqlite_repository.update_rates({"USD": 2, "XXX": 3}, updated_at)
+
+    rates = {currency["code"]: currency["rate"] for currency in await sqlite_repository.get_currencies()}
+    assert rates["USD"] == Decimal("2")
+    assert "XXX" not in rates
+    assert await sqlite_repository.get_last_update_time() == updated_at
+
+
+@pytest.mark.asyncio
+async def test_get_rate_history(sqlite_repository: SQLAlchemyCurrencyRepository):
+    await sqlite_repository.update_rates({"USD": 2, "XXX": 3}, datetime(2024, 3, 1))
+
+    history = await sqlite_repository.get_rate_history({"USD", "XXX"}, datetime(2024, 3, 1))
+    assert history == [(last_update_time, "USD", Decimal("1.081075")), (datetime(2024, 3, 1), "USD", Decimal("2"))]
+
+    # Records after `until` are not returned
+    history = await sqlite_repository.get_rate_history({"USD"}, datetime(2024, 2, 29))
+    assert history == [(last_update_time, "USD", Decimal("1.081075"))]
+
+
+@pytest.mark.asyncio
+async def test_polling_notifier_sees_updates_of_other_processes(sqlite_session: AsyncSession):
+    notifier = PollingRatesNotifier(sqlite_session.bind)
+    events = []
+    notifier.listeners.append(events.append)
+
+    await notifier.poll_once()
+    assert notifier.is_listening
+    assert events == [None]
+
+    # Update made by another worker process sharing the file, without this notifier
+    await SQLAlchemyCurrencyRepository(sqlite_session).update_rates({"USD": 2}, datetime(2024, 3, 1))
+    await notifier.poll_once()
+    await notifier.poll_once()
+
+    assert events == [None, RatesUpdateEvent(version=datetime(2024, 3, 1).isoformat())]